@@ -0,0 +1,47 @@
+"""
+上传准入控制
+
+图片上传需要 Pillow 解析文件，CPU 开销较大。每个 worker 进程最多同时处理 MAX_CONCURRENT_UPLOADS 个上传，
+超出时等待 UPLOAD_SLOT_TIMEOUT 秒，仍无空位则返回 503 并通过 Retry-After 提示客户端稍后重试。
+"""
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+_upload_slots = None
+_upload_slots_lock = threading.Lock()
+
+
+class ServerBusy(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = '服务器繁忙，请稍后重试。'
+    default_code = 'server_busy'
+
+    def __init__(self, detail=None, code=None, wait=None):
+        super().__init__(detail, code)
+        # DRF 的异常处理会根据 wait 设置 Retry-After 响应头
+        self.wait = wait
+
+
+def _get_upload_slots():
+    global _upload_slots
+    if _upload_slots is None:
+        with _upload_slots_lock:
+            if _upload_slots is None:
+                _upload_slots = threading.BoundedSemaphore(settings.MAX_CONCURRENT_UPLOADS)
+    return _upload_slots
+
+
+@contextmanager
+def upload_slot():
+    """占用一个上传处理名额，无空位时抛出 ServerBusy"""
+    slots = _get_upload_slots()
+    if not slots.acquire(timeout=settings.UPLOAD_SLOT_TIMEOUT):
+        raise ServerBusy(wait=settings.UPLOAD_RETRY_AFTER)
+    try:
+        yield
+    finally:
+        slots.release()
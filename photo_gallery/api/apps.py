@@ -4,3 +4,12 @@ from django.apps import AppConfig
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        # 注册缓存失效等信号处理器
+        from . import signals  # noqa: F401
+
+        # Pillow 打开超过该像素数 2 倍的图片时直接拒绝，避免解压炸弹
+        from django.conf import settings
+        from PIL import Image as PILImage
+        PILImage.MAX_IMAGE_PIXELS = settings.MAX_IMAGE_PIXELS
@@ -0,0 +1,118 @@
+"""
+共享缓存工具
+
+- 基于标签版本号的失效：每个缓存键都绑定若干标签，标签的版本号保存在缓存中，
+  信号处理器（见 signals.py）在数据变化时递增版本号，旧的缓存条目自然失效。
+- 防击穿保护：缓存条目记录计算耗时，采用概率提前过期（XFetch）让单个 worker 在过期前
+  重新计算；条目缺失时通过 cache.add 实现的短锁保证只有一个 worker 回源，其余 worker 等待结果。
+
+本地内存缓存（开发/测试）与 Redis 协议缓存（生产）均可使用。
+"""
+import math
+import random
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .db_router import primary_reads
+
+TAG_VERSION_PREFIX = 'tagver:'
+LOCK_PREFIX = 'lock:'
+LOCK_TIMEOUT = 10       # 回源锁的最长持有时间 (秒)
+LOCK_WAIT = 2.0         # 未拿到锁时等待其他 worker 结果的最长时间 (秒)
+LOCK_POLL_INTERVAL = 0.05
+
+# 标签
+TAG_GROUPS = 'groups'
+TAG_IMAGES = 'images'
+
+
+def image_tag(image_id):
+    return f'image:{image_id}'
+
+
+def user_images_tag(user_id):
+    return f'user:{user_id}:images'
+
+
+def user_layouts_tag(user_id):
+    return f'user:{user_id}:layouts'
+
+
+def _tag_key(tag):
+    return f'{TAG_VERSION_PREFIX}{tag}'
+
+
+def _new_version():
+    # 使用时间戳作为初始版本号，避免版本号被淘汰后从 1 重新开始与旧条目冲突
+    return time.time_ns()
+
+
+def get_tag_versions(tags):
+    """返回各标签当前的版本号，缺失的标签会被初始化"""
+    keys = [_tag_key(tag) for tag in tags]
+    found = cache.get_many(keys)
+    for key in keys:
+        if key not in found:
+            cache.add(key, _new_version(), timeout=None)
+            found[key] = cache.get(key)
+    return [found[key] for key in keys]
+
+
+def invalidate_tags(*tags):
+    """递增标签版本号，使所有绑定该标签的缓存条目失效"""
+    for tag in tags:
+        key = _tag_key(tag)
+        try:
+            cache.incr(key)
+        except ValueError:
+            # 标签尚未初始化或已被淘汰
+            cache.set(key, _new_version(), timeout=None)
+
+
+def get_or_compute(key, compute, tags=(), timeout=None, beta=1.0):
+    """
+    从缓存读取 key，未命中时调用 compute() 回源并写入缓存。
+
+    key 会与 tags 的当前版本号组合，任一标签被 invalidate_tags() 后旧条目不再命中。
+    beta 控制提前过期的激进程度，越大越早重新计算。
+    """
+    if timeout is None:
+        timeout = settings.API_CACHE_TIMEOUT
+    versions = get_tag_versions(tags)
+    full_key = ':'.join([key, *(str(v) for v in versions)])
+    lock_key = f'{LOCK_PREFIX}{full_key}'
+
+    entry = cache.get(full_key)
+    if entry is not None:
+        value, delta, expires_at = entry
+        # XFetch：剩余时间越少、计算越慢，提前重新计算的概率越高
+        if time.time() - delta * beta * math.log(1.0 - random.random()) < expires_at:
+            return value
+        if not cache.add(lock_key, 1, LOCK_TIMEOUT):
+            # 已有 worker 在重新计算，继续使用旧值
+            return value
+        locked = True
+    else:
+        locked = cache.add(lock_key, 1, LOCK_TIMEOUT)
+        if not locked:
+            deadline = time.time() + LOCK_WAIT
+            while time.time() < deadline:
+                time.sleep(LOCK_POLL_INTERVAL)
+                entry = cache.get(full_key)
+                if entry is not None:
+                    return entry[0]
+            # 等待超时则自行回源，但不写锁
+
+    try:
+        start = time.time()
+        # 回源时读主库，避免把副本的复制延迟数据写入新版本的缓存
+        with primary_reads():
+            value = compute()
+        delta = time.time() - start
+        cache.set(full_key, (value, delta, time.time() + timeout), timeout)
+    finally:
+        if locked:
+            cache.delete(lock_key)
+    return value
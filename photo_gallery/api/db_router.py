@@ -0,0 +1,69 @@
+"""
+读写分离数据库路由
+
+- 写操作以及默认的读操作都走 default 主库。
+- 视图通过 enable_replica_reads() 显式声明当前请求的读操作可以走只读副本（见 views.ReplicaReadMixin）。
+- 用户发生写操作后，在 DATABASE_REPLICA_STICKY_SECONDS 内该用户的读操作固定走主库，
+  保证能读到自己刚写入的数据 (read-your-writes)。
+"""
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+
+_use_replica = ContextVar('use_replica', default=False)
+
+PIN_PREFIX = 'db:pin:'
+
+
+def replica_aliases():
+    return getattr(settings, 'DATABASE_REPLICAS', [])
+
+
+def enable_replica_reads():
+    """允许当前上下文的读操作路由到只读副本，返回用于 reset_replica_reads() 的 token"""
+    return _use_replica.set(True)
+
+
+def reset_replica_reads(token):
+    _use_replica.reset(token)
+
+
+@contextmanager
+def primary_reads():
+    """在上下文中强制读操作走主库"""
+    token = _use_replica.set(False)
+    try:
+        yield
+    finally:
+        _use_replica.reset(token)
+
+
+def pin_to_primary(user_id):
+    """用户写入后一段时间内的读操作固定走主库"""
+    cache.set(f'{PIN_PREFIX}{user_id}', 1, settings.DATABASE_REPLICA_STICKY_SECONDS)
+
+
+def is_pinned_to_primary(user_id):
+    return cache.get(f'{PIN_PREFIX}{user_id}') is not None
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        replicas = replica_aliases()
+        if replicas and _use_replica.get():
+            return random.choice(replicas)
+        return 'default'
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # 主库和副本中的数据相同，允许跨库关联
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # 副本通过数据库复制同步，只在主库上执行迁移
+        return db == 'default'
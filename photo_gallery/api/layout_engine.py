@@ -0,0 +1,241 @@
+"""
+首页布局排版引擎
+
+根据 HomeLayout.config 和视口宽度，在服务端预先计算每张图片的位置和尺寸，客户端无需下载全部图片
+元数据再自行排版。支持三种布局 (config['layout_type'])：
+
+- grid: 等宽正方形网格
+- masonry: 瀑布流，依次放入当前最短的列
+- justified: 等高行，每行缩放到恰好占满容器宽度
+
+所有排版算法都只遍历一次图片列表，耗时与图片数量成线性关系。分页时各页共用同一个坐标系，
+上一页结束时的排版状态 (网格的图片序号、瀑布流各列的高度、等高行的纵坐标) 随 cursor 传给下一页。
+"""
+import hashlib
+import json
+
+# 与前端 (Ant Design 栅格) 一致的断点，按最小宽度从大到小排列
+BREAKPOINTS = [
+    ('xxl', 1600),
+    ('xl', 1200),
+    ('lg', 992),
+    ('md', 768),
+    ('sm', 576),
+    ('xs', 0),
+]
+
+LAYOUT_TYPES = ('grid', 'masonry', 'justified')
+
+DEFAULT_COLUMNS = 3
+DEFAULT_SPACING = 8
+DEFAULT_PADDING = 16
+DEFAULT_ROW_HEIGHT = 220
+
+# HomeLayout.config 是用户保存的任意 JSON，排版前将各字段限制在合理范围内
+COLUMNS_RANGE = (1, 24)
+SPACING_RANGE = (0, 200)
+PADDING_RANGE = (0, 400)
+ROW_HEIGHT_RANGE = (40, 2000)
+
+
+def config_hash(config):
+    """布局配置的稳定哈希，用作缓存键的一部分"""
+    return hashlib.sha1(json.dumps(config, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def breakpoint_for_width(width):
+    for name, min_width in BREAKPOINTS:
+        if width >= min_width:
+            return name
+    return 'xs'
+
+
+def _coerce_int(value, default, value_range):
+    """转换为整数并限制在 value_range 内，无法转换时使用默认值"""
+    if value is None or isinstance(value, bool):
+        return default
+    try:
+        value = int(value)
+    except (TypeError, ValueError, OverflowError):
+        return default
+    low, high = value_range
+    return min(max(value, low), high)
+
+
+def normalize_config(config):
+    """将用户保存的布局配置整理为排版所需的字段，非法值回退到默认值"""
+    if not isinstance(config, dict):
+        config = {}
+    layout_type = config.get('layout_type')
+    normalized = {
+        'layout_type': layout_type if layout_type in LAYOUT_TYPES else 'grid',
+        'columns': _coerce_int(config.get('columns'), DEFAULT_COLUMNS, COLUMNS_RANGE),
+        'image_spacing': _coerce_int(config.get('image_spacing'), DEFAULT_SPACING, SPACING_RANGE),
+        'grid_padding': _coerce_int(config.get('grid_padding'), DEFAULT_PADDING, PADDING_RANGE),
+        'row_height': _coerce_int(config.get('row_height'), DEFAULT_ROW_HEIGHT, ROW_HEIGHT_RANGE),
+    }
+    for name, _ in BREAKPOINTS:
+        # 未配置的断点回退到 columns
+        normalized[name] = _coerce_int(config.get(name), normalized['columns'], COLUMNS_RANGE)
+    return normalized
+
+
+def columns_for_breakpoint(config, breakpoint):
+    """断点对应的列数，config 需经过 normalize_config 整理"""
+    return config[breakpoint]
+
+
+def _aspect_ratio(item):
+    width, height = item.get('width'), item.get('height')
+    if not width or not height:
+        # 尺寸未知的图片按正方形处理
+        return 1.0
+    return width / height
+
+
+def _tile(item, x, y, width, height):
+    return {
+        'id': item['id'],
+        'image': item.get('image'),
+        'blurhash': item.get('blurhash', ''),
+        'dominant_color': item.get('dominant_color', ''),
+        'x': round(x, 1),
+        'y': round(y, 1),
+        'width': round(width, 1),
+        'height': round(height, 1),
+    }
+
+
+def pack_grid(items, container_width, columns, spacing=DEFAULT_SPACING, padding=DEFAULT_PADDING, start=0):
+    """start 为前面各页已排版的图片数，返回 (tiles, 总高度, 续排状态)"""
+    content_width = max(container_width - 2 * padding, 1)
+    cell = max((content_width - spacing * (columns - 1)) / columns, 1)
+    tiles = []
+    for index, item in enumerate(items, start):
+        row, column = divmod(index, columns)
+        tiles.append(_tile(item, padding + column * (cell + spacing), padding + row * (cell + spacing), cell, cell))
+    count = start + len(items)
+    rows = -(-count // columns)
+    height = 2 * padding + rows * cell + max(rows - 1, 0) * spacing
+    return tiles, round(height, 1), {'index': count}
+
+
+def pack_masonry(items, container_width, columns, spacing=DEFAULT_SPACING, padding=DEFAULT_PADDING,
+                 column_heights=None):
+    """column_heights 为前面各页结束时每列的高度，返回 (tiles, 总高度, 续排状态)"""
+    content_width = max(container_width - 2 * padding, 1)
+    column_width = max((content_width - spacing * (columns - 1)) / columns, 1)
+    column_heights = list(column_heights) if column_heights else [0.0] * columns
+    tiles = []
+    for item in items:
+        # 列数不超过 COLUMNS_RANGE 的上限，直接线性查找最短列
+        column = min(range(columns), key=column_heights.__getitem__)
+        height = column_width / _aspect_ratio(item)
+        tiles.append(_tile(item, padding + column * (column_width + spacing), padding + column_heights[column],
+                           column_width, height))
+        column_heights[column] += height + spacing
+    tallest = max(column_heights)
+    content_height = tallest - spacing if tallest > 0 else 0
+    return tiles, round(2 * padding + content_height, 1), {'column_heights': column_heights}
+
+
+def pack_justified(items, container_width, row_height=DEFAULT_ROW_HEIGHT, spacing=DEFAULT_SPACING,
+                   padding=DEFAULT_PADDING, y=None, final=True):
+    """
+    y 为前面各页结束时的纵坐标，返回 (tiles, 总高度, 续排状态)。
+
+    final 为 False 时 (后面还有图片)，末尾不足一整行的图片不排版，由下一页接着组成完整的行，
+    tiles 只包含已排版的图片。
+    """
+    content_width = max(container_width - 2 * padding, 1)
+    tiles = []
+    y = padding if y is None else y
+    row, row_aspect = [], 0.0
+
+    def flush(height):
+        x = padding
+        for item, aspect in row:
+            width = aspect * height
+            tiles.append(_tile(item, x, y, width, height))
+            x += width + spacing
+
+    for item in items:
+        aspect = _aspect_ratio(item)
+        row.append((item, aspect))
+        row_aspect += aspect
+        # 行内图片按目标行高排列已超出容器宽度时，缩放该行使其恰好占满宽度
+        available = content_width - spacing * (len(row) - 1)
+        if row_aspect * row_height >= available:
+            height = available / row_aspect
+            flush(height)
+            y += height + spacing
+            row, row_aspect = [], 0.0
+
+    if row and final:
+        # 最后一行不足一整行时保持目标行高，不拉伸
+        flush(row_height)
+        y += row_height + spacing
+
+    content_height = y - spacing if y > padding else padding
+    return tiles, round(content_height + padding, 1), {'y': y}
+
+
+def normalize_state(state, config, viewport_width):
+    """
+    校验客户端通过 cursor 传回的续排状态，config 需经过 normalize_config 整理。
+
+    状态必须由相同布局类型和宽度的上一页生成，否则返回 None。
+    """
+    if not isinstance(state, dict):
+        return None
+    if state.get('layout_type') != config['layout_type'] or state.get('width') != viewport_width:
+        return None
+
+    def is_offset(value):
+        return isinstance(value, (int, float)) and not isinstance(value, bool) and 0 <= value < float('inf')
+
+    if config['layout_type'] == 'justified':
+        valid = is_offset(state.get('y'))
+    elif config['layout_type'] == 'masonry':
+        heights = state.get('column_heights')
+        columns = columns_for_breakpoint(config, breakpoint_for_width(viewport_width))
+        valid = isinstance(heights, list) and len(heights) == columns and all(is_offset(h) for h in heights)
+    else:
+        valid = isinstance(state.get('index'), int) and is_offset(state['index'])
+    return state if valid else None
+
+
+def pack(items, config, viewport_width, state=None, final=True):
+    """
+    按布局配置为一组图片排版，返回 (layout 描述, tiles, 总高度, 续排状态)。
+
+    分页排版时，把上一页返回的续排状态 (经 normalize_state 校验) 传给下一页，各页的结果拼接起来
+    与一次排版全部图片相同；final 表示这是否为最后一页，见 pack_justified。
+    """
+    config = normalize_config(config)
+    layout_type = config['layout_type']
+    breakpoint = breakpoint_for_width(viewport_width)
+    columns = columns_for_breakpoint(config, breakpoint)
+    spacing = config['image_spacing']
+    padding = config['grid_padding']
+    state = state or {}
+
+    if layout_type == 'justified':
+        tiles, height, next_state = pack_justified(
+            items, viewport_width, config['row_height'], spacing, padding, state.get('y'), final
+        )
+    elif layout_type == 'masonry':
+        tiles, height, next_state = pack_masonry(
+            items, viewport_width, columns, spacing, padding, state.get('column_heights')
+        )
+    else:
+        tiles, height, next_state = pack_grid(items, viewport_width, columns, spacing, padding, state.get('index', 0))
+
+    layout = {
+        'layout_type': layout_type,
+        'breakpoint': breakpoint,
+        'columns': columns,
+        'image_spacing': spacing,
+        'grid_padding': padding,
+    }
+    return layout, tiles, height, {'layout_type': layout_type, 'width': viewport_width, **next_state}
@@ -0,0 +1,92 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api import cache as api_cache
+from api.models import Image
+from api.placeholders import compute_placeholders_for_path, init_worker
+
+
+class Command(BaseCommand):
+    help = "使用进程池为已有图片计算 BlurHash 和主色调，支持从检查点继续"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="进程数")
+        parser.add_argument('--batch-size', type=int, default=200, help="每批处理的图片数")
+        parser.add_argument(
+            '--checkpoint',
+            default=os.path.join(settings.BASE_DIR, '.backfill_placeholders.checkpoint'),
+            help="检查点文件路径，记录已处理的最大图片 ID",
+        )
+        parser.add_argument('--restart', action='store_true', help="忽略检查点，从头开始")
+
+    def _read_checkpoint(self, path):
+        try:
+            with open(path) as f:
+                return int(f.read().strip() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def _write_checkpoint(self, path, last_id):
+        # 先写临时文件再替换，中断时不会留下损坏的检查点
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(str(last_id))
+        os.replace(tmp_path, path)
+
+    def handle(self, *args, **options):
+        checkpoint = options['checkpoint']
+        batch_size = options['batch_size']
+        last_id = 0 if options['restart'] else self._read_checkpoint(checkpoint)
+        if last_id:
+            self.stdout.write(f"从检查点继续：图片 ID > {last_id}")
+
+        updated = failed = 0
+        # 本次运行中第一张失败的图片，检查点不会越过它，下次运行时会重试
+        first_failed_id = None
+        with ProcessPoolExecutor(
+            max_workers=options['workers'],
+            initializer=init_worker,
+            initargs=(settings.MAX_IMAGE_PIXELS,),
+        ) as pool:
+            while True:
+                rows = list(
+                    Image.objects.filter(pk__gt=last_id, blurhash='')
+                    .exclude(image='')
+                    .order_by('pk')
+                    .values_list('pk', 'image')[:batch_size]
+                )
+                if not rows:
+                    break
+
+                tasks = [(pk, default_storage.path(name)) for pk, name in rows]
+                chunksize = max(1, len(tasks) // (options['workers'] * 4))
+                results = list(pool.map(compute_placeholders_for_path, tasks, chunksize=chunksize))
+
+                images = []
+                for pk, blurhash, color in results:
+                    if blurhash is None:
+                        failed += 1
+                        if first_failed_id is None:
+                            first_failed_id = pk
+                        self.stderr.write(f"图片 {pk} 处理失败，已跳过")
+                        continue
+                    images.append(Image(pk=pk, blurhash=blurhash, dominant_color=color))
+
+                with transaction.atomic():
+                    # bulk_update 不触发信号，手动失效相关缓存
+                    Image.objects.bulk_update(images, ['blurhash', 'dominant_color'])
+                    tags = [api_cache.TAG_IMAGES, *(api_cache.image_tag(image.pk) for image in images)]
+                    transaction.on_commit(lambda tags=tags: api_cache.invalidate_tags(*tags))
+
+                updated += len(images)
+                last_id = rows[-1][0]
+                # 已成功的图片不再满足 blurhash='' 的条件，从失败的图片处重新开始也不会重复处理
+                self._write_checkpoint(checkpoint, last_id if first_failed_id is None else first_failed_id - 1)
+                self.stdout.write(f"已处理到图片 ID {last_id}，更新 {updated} 张")
+
+        self.stdout.write(self.style.SUCCESS(f"完成：更新 {updated} 张图片，失败 {failed} 张"))
@@ -0,0 +1,40 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from api import layout_engine
+
+
+class Command(BaseCommand):
+    help = "使用随机尺寸的图片测试各种布局的排版耗时"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=100_000, help="图片数量")
+        parser.add_argument('--width', type=int, default=1440, help="视口宽度 (px)")
+        parser.add_argument('--repeat', type=int, default=3, help="每种布局重复次数，取最快的一次")
+        parser.add_argument('--seed', type=int, default=0, help="随机数种子")
+
+    def handle(self, *args, **options):
+        count, width, repeat = options['count'], options['width'], options['repeat']
+        rng = random.Random(options['seed'])
+        sizes = [(4000, 3000), (3000, 4000), (1920, 1080), (1080, 1920), (2048, 2048), (6000, 2000)]
+        items = []
+        for index in range(count):
+            image_width, image_height = rng.choice(sizes)
+            items.append({'id': index, 'image': None, 'width': image_width, 'height': image_height})
+
+        base_config = {'xs': 1, 'sm': 2, 'md': 3, 'lg': 4, 'xl': 4, 'xxl': 6, 'image_spacing': 8, 'grid_padding': 16}
+        self.stdout.write(f"{count} 张图片，视口宽度 {width}px")
+        for layout_type in ('grid', 'masonry', 'justified'):
+            config = dict(base_config, layout_type=layout_type)
+            best = None
+            for _ in range(repeat):
+                start = time.perf_counter()
+                _, tiles, height, _ = layout_engine.pack(items, config, width)
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            self.stdout.write(
+                f"{layout_type:<10} {best * 1000:8.1f} ms  "
+                f"({count / best:,.0f} 张/秒，{len(tiles)} 个图块，总高度 {height}px)"
+            )
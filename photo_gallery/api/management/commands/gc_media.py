@@ -0,0 +1,72 @@
+from datetime import timedelta
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from api.media_gc import UnsortedStreamError, iter_db_names, iter_storage_names, merge_join
+from api.models import Image
+
+
+class Command(BaseCommand):
+    help = "对账媒体存储与图片记录：报告或删除没有记录引用的孤儿文件，报告指向丢失文件的记录"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help="每批从数据库读取的文件名数量")
+        parser.add_argument(
+            '--grace-hours', type=float, default=24,
+            help="宽限期 (小时)，更新时间在宽限期内的文件/记录不处理，避免误删正在上传的文件",
+        )
+        parser.add_argument('--delete', action='store_true', help="删除超过宽限期的孤儿文件")
+        parser.add_argument('--prune-missing', action='store_true', help="删除指向丢失文件且超过宽限期的图片记录")
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(hours=options['grace_hours'])
+        stats = {'orphan': 0, 'deleted': 0, 'missing': 0, 'pruned': 0, 'recent': 0}
+
+        try:
+            for kind, name in merge_join(iter_storage_names(default_storage), iter_db_names(options['batch_size'])):
+                if kind == 'orphan':
+                    self._handle_orphan(name, cutoff, options['delete'], stats)
+                else:
+                    self._handle_missing(name, cutoff, options['prune_missing'], stats)
+        except UnsortedStreamError as e:
+            # 顺序不一致时归并结果不可信，立即停止以免误删
+            raise CommandError(str(e))
+
+        self.stdout.write(self.style.SUCCESS(
+            f"孤儿文件 {stats['orphan']} 个 (已删除 {stats['deleted']} 个)，"
+            f"丢失文件的记录 {stats['missing']} 个 (已删除 {stats['pruned']} 条)，"
+            f"宽限期内跳过 {stats['recent']} 个"
+        ))
+
+    def _handle_orphan(self, name, cutoff, delete, stats):
+        try:
+            modified = default_storage.get_modified_time(name)
+        except FileNotFoundError:
+            return
+        if modified > cutoff:
+            stats['recent'] += 1
+            return
+        stats['orphan'] += 1
+        if delete:
+            default_storage.delete(name)
+            stats['deleted'] += 1
+            self.stdout.write(f"已删除孤儿文件：{name}")
+        else:
+            self.stdout.write(f"孤儿文件：{name}")
+
+    def _handle_missing(self, name, cutoff, prune, stats):
+        images = Image.objects.filter(image=name, uploaded_at__lt=cutoff)
+        ids = list(images.values_list('pk', flat=True))
+        if not ids:
+            stats['recent'] += 1
+            return
+        stats['missing'] += 1
+        if prune:
+            # 通过查询集删除，会触发存储用量和缓存的信号处理
+            images.delete()
+            stats['pruned'] += len(ids)
+            self.stdout.write(f"已删除指向丢失文件的记录：{name} (图片 {ids})")
+        else:
+            self.stdout.write(f"丢失文件：{name} (图片 {ids})")
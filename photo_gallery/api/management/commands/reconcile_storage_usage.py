@@ -0,0 +1,65 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Sum
+
+from api.models import Image, StorageUsage
+
+
+class Command(BaseCommand):
+    help = "按批次重新计算每个用户的图片数量和存储用量计数，修正与图片表不一致的记录"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help="每批处理的用户数")
+        parser.add_argument('--dry-run', action='store_true', help="只报告不一致的记录，不写入")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        dry_run = options['dry_run']
+        checked = fixed = 0
+        last_id = 0
+
+        while True:
+            # 按主键分批遍历用户，每批只聚合该批用户的图片
+            user_ids = list(
+                User.objects.filter(pk__gt=last_id).order_by('pk').values_list('pk', flat=True)[:batch_size]
+            )
+            if not user_ids:
+                break
+            last_id = user_ids[-1]
+
+            with transaction.atomic():
+                # 先锁定计数记录，避免与并发上传/删除的计数更新交错
+                usages = StorageUsage.objects.select_for_update().in_bulk(user_ids)
+                actual = {
+                    row['owner_id']: (row['image_count'], row['total_bytes'] or 0)
+                    for row in Image.objects.filter(owner_id__in=user_ids)
+                    .values('owner_id')
+                    .annotate(image_count=Count('id'), total_bytes=Sum('size'))
+                }
+
+                to_create, to_update = [], []
+                for user_id in user_ids:
+                    image_count, total_bytes = actual.get(user_id, (0, 0))
+                    usage = usages.get(user_id)
+                    if usage is None:
+                        if image_count:
+                            to_create.append(StorageUsage(user_id=user_id, image_count=image_count, total_bytes=total_bytes))
+                    elif (usage.image_count, usage.total_bytes) != (image_count, total_bytes):
+                        self.stdout.write(
+                            f"用户 {user_id}: {usage.image_count} 张/{usage.total_bytes} bytes -> "
+                            f"{image_count} 张/{total_bytes} bytes"
+                        )
+                        usage.image_count = image_count
+                        usage.total_bytes = total_bytes
+                        to_update.append(usage)
+
+                if not dry_run:
+                    StorageUsage.objects.bulk_create(to_create)
+                    StorageUsage.objects.bulk_update(to_update, ['image_count', 'total_bytes'])
+
+            checked += len(user_ids)
+            fixed += len(to_create) + len(to_update)
+
+        action = "需要修正" if dry_run else "已修正"
+        self.stdout.write(self.style.SUCCESS(f"检查了 {checked} 个用户，{action} {fixed} 条计数记录"))
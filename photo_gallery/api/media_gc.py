@@ -0,0 +1,101 @@
+"""
+媒体文件与数据库记录的对账
+
+存储中的文件名和数据库中的图片文件名都以相同的顺序 (按 Unicode 码位的字典序) 分批流式读取，
+再做一次归并连接 (merge join)，任何一侧都不需要完整载入内存：
+
+- 只在存储中存在的文件为孤儿文件 (批量删除、级联删除、上传失败等遗留)；
+- 只在数据库中存在的文件名说明记录指向了丢失的文件。
+
+两侧的顺序必须一致，否则归并结果不可信；iter_* 函数在发现顺序错乱时抛出 UnsortedStreamError。
+"""
+import posixpath
+
+from django.db import connection
+from django.db.models.functions import Collate
+
+from .models import Image
+
+# 各数据库中按码位比较字符串的排序规则
+BINARY_COLLATIONS = {
+    'mysql': 'utf8mb4_bin',
+    'sqlite': 'BINARY',
+    'postgresql': 'C',
+}
+
+
+class UnsortedStreamError(Exception):
+    pass
+
+
+def _ensure_sorted(names, source):
+    previous = None
+    for name in names:
+        if previous is not None and name < previous:
+            raise UnsortedStreamError(f"{source} 的文件名顺序错乱：{previous!r} 之后出现 {name!r}")
+        previous = name
+        yield name
+
+
+def _walk_storage(storage, path):
+    dirs, files = storage.listdir(path)
+    # 目录名加上 '/' 参与排序，使其子路径整体落在正确的位置，与完整路径的字典序一致
+    entries = sorted([(name + '/', True) for name in dirs] + [(name, False) for name in files])
+    for key, is_dir in entries:
+        if key.startswith('.'):
+            # 跳过隐藏文件和隐藏目录 (如 .cache/)，不把其中的文件当作孤儿文件
+            continue
+        name = posixpath.join(path, key.rstrip('/')) if path else key.rstrip('/')
+        if is_dir:
+            yield from _walk_storage(storage, name)
+        else:
+            yield name
+
+
+def iter_storage_names(storage):
+    """按完整相对路径的字典序产出存储中的文件名，同一时间只在内存中保存一个目录的列表"""
+    return _ensure_sorted(_walk_storage(storage, ''), '存储')
+
+
+def _iter_db_names(batch_size):
+    collation = BINARY_COLLATIONS.get(connection.vendor)
+    if collation is None:
+        raise UnsortedStreamError(f"不支持的数据库：{connection.vendor}")
+    queryset = (
+        Image.objects.exclude(image='')
+        .annotate(file_name=Collate('image', collation))
+        .order_by('file_name')
+        .values_list('file_name', flat=True)
+    )
+    last = None
+    while True:
+        batch = queryset.filter(file_name__gt=last) if last is not None else queryset
+        names = list(batch[:batch_size])
+        if not names:
+            return
+        for name in names:
+            # 多条记录可能指向同一文件
+            if name != last:
+                yield name
+                last = name
+
+
+def iter_db_names(batch_size=1000):
+    """按码位顺序分批产出数据库中引用的文件名 (去重)"""
+    return _ensure_sorted(_iter_db_names(batch_size), '数据库')
+
+
+def merge_join(storage_names, db_names):
+    """归并两个有序流，产出 ('orphan', 文件名) 或 ('missing', 文件名)"""
+    stored = next(storage_names, None)
+    referenced = next(db_names, None)
+    while stored is not None or referenced is not None:
+        if referenced is None or (stored is not None and stored < referenced):
+            yield 'orphan', stored
+            stored = next(storage_names, None)
+        elif stored is None or referenced < stored:
+            yield 'missing', referenced
+            referenced = next(db_names, None)
+        else:
+            stored = next(storage_names, None)
+            referenced = next(db_names, None)
@@ -0,0 +1,52 @@
+# Generated by Django 4.2 on 2026-10-19 16:16
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Sum
+import django.db.models.deletion
+
+
+def populate_storage_usage(apps, schema_editor):
+    Image = apps.get_model('api', 'Image')
+    StorageUsage = apps.get_model('api', 'StorageUsage')
+
+    # 按用户聚合一次即可得到全部计数
+    rows = (
+        Image.objects.filter(owner__isnull=False)
+        .values('owner_id')
+        .annotate(image_count=Count('id'), total_bytes=Sum('size'))
+    )
+    StorageUsage.objects.bulk_create(
+        [
+            StorageUsage(user_id=row['owner_id'], image_count=row['image_count'], total_bytes=row['total_bytes'] or 0)
+            for row in rows
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('api', '0006_add_spacing_to_layouts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StorageUsage',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='storage_usage', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('image_count', models.BigIntegerField(default=0, help_text='图片数量')),
+                ('total_bytes', models.BigIntegerField(default=0, help_text='图片总大小 (bytes)')),
+                ('quota_bytes', models.BigIntegerField(blank=True, help_text='存储配额 (bytes)，为空时使用 STORAGE_QUOTA_BYTES', null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='homelayout',
+            name='config',
+            field=models.JSONField(default=dict, help_text='布局配置JSON，包含image_spacing和grid_padding等设置'),
+        ),
+        migrations.RunPython(populate_storage_usage, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2 on 2026-10-19 16:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_storageusage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='blurhash',
+            field=models.CharField(blank=True, editable=False, help_text='BlurHash 占位字符串', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='dominant_color',
+            field=models.CharField(blank=True, editable=False, help_text='主色调 (#rrggbb)', max_length=7),
+        ),
+    ]
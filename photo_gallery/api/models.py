@@ -1,7 +1,13 @@
-from django.db import models
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import models, transaction, IntegrityError
+from django.db.models import F
 from django.contrib.auth.models import User
+from PIL import Image as PILImage
 import os
 
+from .placeholders import compute_placeholders
+
 def get_upload_path(instance, filename):
     """自定义上传路径，例如：MEDIA_ROOT/user_<id>/<filename>"""
     # 如果你想按用户存储，可以取消注释下一行并确保模型有关联的用户字段
@@ -23,6 +29,8 @@ class Image(models.Model):
     width = models.IntegerField(editable=False, null=True, blank=True, help_text="图片宽度 (px)")
     height = models.IntegerField(editable=False, null=True, blank=True, help_text="图片高度 (px)")
     size = models.BigIntegerField(editable=False, null=True, blank=True, help_text="图片大小 (bytes)")
+    blurhash = models.CharField(max_length=64, blank=True, editable=False, help_text="BlurHash 占位字符串")
+    dominant_color = models.CharField(max_length=7, blank=True, editable=False, help_text="主色调 (#rrggbb)")
     owner = models.ForeignKey(User, related_name='images', on_delete=models.CASCADE, null=True, blank=True) # 可选：关联上传用户
     groups = models.ManyToManyField(Group, related_name='images', blank=True, help_text="图片所属分组")
     uploaded_at = models.DateTimeField(auto_now_add=True)
@@ -46,13 +54,106 @@ class Image(models.Model):
                 self.width = None
                 self.height = None
                 self.size = None
-        super().save(*args, **kwargs)
+
+        # 新上传的文件：从缩小的解码结果计算占位信息
+        if self.image and not getattr(self.image, '_committed', True):
+            try:
+                self.image.seek(0)
+                self.blurhash, self.dominant_color = compute_placeholders(self.image)
+            except (OSError, ValueError, PILImage.DecompressionBombError):
+                self.blurhash, self.dominant_color = '', ''
+            finally:
+                self.image.seek(0)
+
+        # 与用户的存储用量计数在同一事务中更新
+        with transaction.atomic():
+            previous = None
+            if self.pk:
+                previous = Image.objects.select_for_update().filter(pk=self.pk).values('owner_id', 'size').first()
+            if previous is None or previous['owner_id'] != self.owner_id:
+                bytes_delta = self.size or 0
+            else:
+                bytes_delta = (self.size or 0) - (previous['size'] or 0)
+            # 在写入文件和记录之前检查配额，超出时抛出 StorageQuotaExceeded
+            if bytes_delta > 0:
+                StorageUsage.check_quota(self.owner_id, bytes_delta)
+            super().save(*args, **kwargs)
+            if previous is None:
+                StorageUsage.adjust(self.owner_id, 1, self.size or 0)
+            elif previous['owner_id'] != self.owner_id:
+                StorageUsage.adjust(previous['owner_id'], -1, -(previous['size'] or 0))
+                StorageUsage.adjust(self.owner_id, 1, self.size or 0)
+            else:
+                # 替换图片文件时只调整大小
+                StorageUsage.adjust(self.owner_id, 0, (self.size or 0) - (previous['size'] or 0))
 
     def delete(self, *args, **kwargs):
         # 删除模型实例时，同时删除关联的图片文件
         self.image.delete(save=False) # save=False 避免再次调用 save 方法
         super().delete(*args, **kwargs)
 
+class StorageQuotaExceeded(ValidationError):
+    """上传后超出用户的存储配额"""
+
+
+class StorageUsage(models.Model):
+    """用户存储用量的冗余计数，避免统计时扫描图片表"""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='storage_usage')
+    image_count = models.BigIntegerField(default=0, help_text="图片数量")
+    total_bytes = models.BigIntegerField(default=0, help_text="图片总大小 (bytes)")
+    quota_bytes = models.BigIntegerField(null=True, blank=True, help_text="存储配额 (bytes)，为空时使用 STORAGE_QUOTA_BYTES")
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.user_id}: {self.image_count} images, {self.total_bytes} bytes"
+
+    @property
+    def effective_quota(self):
+        return self.quota_bytes if self.quota_bytes is not None else settings.STORAGE_QUOTA_BYTES
+
+    @classmethod
+    def check_quota(cls, user_id, bytes_delta):
+        """
+        锁定用户的计数记录并检查增加 bytes_delta 后是否超出配额，应在修改图片的同一事务中调用。
+        记录被锁定到事务结束，同一用户的并发上传会依次检查，不会一起超出配额。
+        """
+        if not user_id:
+            return
+        usage = cls.objects.select_for_update().filter(user_id=user_id).first()
+        if usage is None:
+            if not settings.STORAGE_QUOTA_BYTES:
+                return
+            # 首次上传时先创建记录，使并发的首次上传也能依次加锁检查
+            cls.objects.get_or_create(user_id=user_id)
+            usage = cls.objects.select_for_update().get(user_id=user_id)
+        quota = usage.effective_quota
+        if quota and usage.total_bytes + bytes_delta > quota:
+            raise StorageQuotaExceeded(
+                f"存储空间不足：已使用 {usage.total_bytes} bytes，配额 {quota} bytes，本次上传 {bytes_delta} bytes。"
+            )
+
+    @classmethod
+    def adjust(cls, user_id, count_delta, bytes_delta):
+        """原子地调整用户的计数，应在修改图片的同一事务中调用"""
+        if not user_id or (not count_delta and not bytes_delta):
+            return
+        updated = cls.objects.filter(user_id=user_id).update(
+            image_count=F('image_count') + count_delta,
+            total_bytes=F('total_bytes') + bytes_delta,
+        )
+        # 只在新增图片时创建计数记录；减少计数时记录不存在 (如用户正在被删除) 则忽略
+        if updated or count_delta <= 0:
+            return
+        try:
+            with transaction.atomic():
+                cls.objects.create(user_id=user_id, image_count=count_delta, total_bytes=bytes_delta)
+        except IntegrityError:
+            # 并发请求已创建记录
+            cls.objects.filter(user_id=user_id).update(
+                image_count=F('image_count') + count_delta,
+                total_bytes=F('total_bytes') + bytes_delta,
+            )
+
 class HomeLayout(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='layouts')
     name = models.CharField(max_length=100, help_text="布局名称")
@@ -0,0 +1,115 @@
+"""
+图片占位信息：BlurHash 字符串和主色调
+
+上传时根据大幅缩小后的图片计算，客户端在原图下载完成前即可绘制模糊预览。
+本模块只依赖 Pillow，不导入 Django 模型，可以在 backfill_placeholders 命令的子进程中直接使用。
+"""
+import math
+
+from PIL import Image as PILImage
+
+# BlurHash 的横向/纵向分量数，4x3 编码后为 28 个字符
+BLURHASH_COMPONENTS = (4, 3)
+# 计算前将图片缩小到的最大边长
+SAMPLE_SIZE = 32
+
+_BASE83 = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz#$%*+,-.:;=?@[]^_{|}~'
+
+
+def _encode83(value, length):
+    return ''.join(_BASE83[(value // 83 ** (length - 1 - i)) % 83] for i in range(length))
+
+
+def _srgb_to_linear(value):
+    v = value / 255
+    return v / 12.92 if v <= 0.04045 else ((v + 0.055) / 1.055) ** 2.4
+
+
+def _linear_to_srgb(value):
+    v = max(0.0, min(1.0, value))
+    if v <= 0.0031308:
+        return int(v * 12.92 * 255 + 0.5)
+    return int((1.055 * v ** (1 / 2.4) - 0.055) * 255 + 0.5)
+
+
+def _sign_pow(value, exponent):
+    return math.copysign(abs(value) ** exponent, value)
+
+
+def encode_blurhash(pixels, width, height, x_components=BLURHASH_COMPONENTS[0], y_components=BLURHASH_COMPONENTS[1]):
+    """按 BlurHash 算法编码 RGB 像素列表 (按行排列)"""
+    linear = [tuple(_srgb_to_linear(c) for c in pixel) for pixel in pixels]
+    cos_x = [[math.cos(math.pi * i * x / width) for x in range(width)] for i in range(x_components)]
+    cos_y = [[math.cos(math.pi * j * y / height) for y in range(height)] for j in range(y_components)]
+
+    factors = []
+    for j in range(y_components):
+        for i in range(x_components):
+            normalisation = 1 if i == 0 and j == 0 else 2
+            r = g = b = 0.0
+            for y in range(height):
+                row_basis = normalisation * cos_y[j][y]
+                row_offset = y * width
+                for x in range(width):
+                    basis = row_basis * cos_x[i][x]
+                    pr, pg, pb = linear[row_offset + x]
+                    r += basis * pr
+                    g += basis * pg
+                    b += basis * pb
+            scale = 1 / (width * height)
+            factors.append((r * scale, g * scale, b * scale))
+
+    dc, ac = factors[0], factors[1:]
+    result = _encode83((x_components - 1) + (y_components - 1) * 9, 1)
+
+    if ac:
+        actual_max = max(abs(c) for factor in ac for c in factor)
+        quantised_max = max(0, min(82, int(math.floor(actual_max * 166 - 0.5))))
+        max_value = (quantised_max + 1) / 166
+        result += _encode83(quantised_max, 1)
+    else:
+        max_value = 1
+        result += _encode83(0, 1)
+
+    result += _encode83((_linear_to_srgb(dc[0]) << 16) + (_linear_to_srgb(dc[1]) << 8) + _linear_to_srgb(dc[2]), 4)
+
+    for factor in ac:
+        quantised = [max(0, min(18, int(math.floor(_sign_pow(c / max_value, 0.5) * 9 + 9.5)))) for c in factor]
+        result += _encode83(quantised[0] * 19 * 19 + quantised[1] * 19 + quantised[2], 2)
+    return result
+
+
+def dominant_color(image):
+    """缩略图中出现最多的颜色，返回 #rrggbb"""
+    palette_image = image.quantize(colors=8)
+    palette = palette_image.getpalette()
+    _, index = max(palette_image.getcolors())
+    r, g, b = palette[index * 3:index * 3 + 3]
+    return f'#{r:02x}{g:02x}{b:02x}'
+
+
+def compute_placeholders(fp):
+    """从文件路径或文件对象计算 (blurhash, dominant_color)"""
+    with PILImage.open(fp) as image:
+        # 先缩小再转换颜色模式：thumbnail() 会利用 draft() (JPEG 按比例解码) 和 reduce() 降低解码开销，
+        # 之后只需转换 32px 的小图，避免对 PNG/GIF/WebP 等格式复制全尺寸的 RGB 图像
+        image.draft('RGB', (SAMPLE_SIZE * 2, SAMPLE_SIZE * 2))
+        image.thumbnail((SAMPLE_SIZE, SAMPLE_SIZE))
+        image = image.convert('RGB')
+    width, height = image.size
+    return encode_blurhash(list(image.getdata()), width, height), dominant_color(image)
+
+
+def init_worker(max_image_pixels):
+    """子进程初始化：与主进程使用相同的解压炸弹限制"""
+    PILImage.MAX_IMAGE_PIXELS = max_image_pixels
+
+
+def compute_placeholders_for_path(task):
+    """子进程任务：task 为 (图片 ID, 文件路径)，失败时返回空结果"""
+    image_id, path = task
+    try:
+        blurhash, color = compute_placeholders(path)
+    except (OSError, ValueError, PILImage.DecompressionBombError):
+        return image_id, None, None
+    return image_id, blurhash, color
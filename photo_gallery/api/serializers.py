@@ -1,17 +1,40 @@
+from django.conf import settings
 from django.contrib.auth.models import User
 from rest_framework import serializers
-from .models import Image, Group, HomeLayout # 新增导入 HomeLayout
+from .models import Image, Group, HomeLayout, StorageUsage # 新增导入 HomeLayout
 
 class UserSerializer(serializers.ModelSerializer):
     password = serializers.CharField(write_only=True, required=True, style={'input_type': 'password'})
     password2 = serializers.CharField(write_only=True, required=True, style={'input_type': 'password'}, label="确认密码")
-    images = serializers.PrimaryKeyRelatedField(many=True, read_only=True) # 用户上传的图片
+    # 用户的存储用量，来自冗余计数而不是逐条列出图片
+    image_count = serializers.SerializerMethodField()
+    storage_bytes = serializers.SerializerMethodField()
+    storage_quota = serializers.SerializerMethodField()
     
     class Meta:
         model = User
-        fields = ['id', 'username', 'email', 'first_name', 'last_name', 'password', 'password2', 'images', 'is_staff']
+        fields = ['id', 'username', 'email', 'first_name', 'last_name', 'password', 'password2',
+                  'image_count', 'storage_bytes', 'storage_quota', 'is_staff']
         read_only_fields = ('is_staff', 'id')
 
+    def _get_usage(self, obj):
+        try:
+            return obj.storage_usage
+        except StorageUsage.DoesNotExist:
+            return None
+
+    def get_image_count(self, obj):
+        usage = self._get_usage(obj)
+        return usage.image_count if usage else 0
+
+    def get_storage_bytes(self, obj):
+        usage = self._get_usage(obj)
+        return usage.total_bytes if usage else 0
+
+    def get_storage_quota(self, obj):
+        usage = self._get_usage(obj)
+        return usage.effective_quota if usage else settings.STORAGE_QUOTA_BYTES
+
     def validate(self, attrs):
         if attrs.get('password') != attrs.get('password2'):
             raise serializers.ValidationError({"password": "两次输入的密码不匹配。"})
@@ -49,15 +72,41 @@ class ImageSerializer(serializers.ModelSerializer):
             'width',
             'height',
             'size',
+            'blurhash',
+            'dominant_color',
             'groups',
             'owner',
             'owner_username',
             'uploaded_at',
             'updated_at',
         ]
-        read_only_fields = ('width', 'height', 'size', 'uploaded_at', 'updated_at', 'owner', 'owner_username')
+        read_only_fields = ('width', 'height', 'size', 'blurhash', 'dominant_color', 'uploaded_at', 'updated_at', 'owner', 'owner_username')
 
     def validate_image(self, value):
+        # 防御解压炸弹：ImageField 校验时只解析了文件头，在完整解码前检查像素数
+        image = getattr(value, 'image', None)
+        if image is not None:
+            width, height = image.size
+            if width * height > settings.MAX_IMAGE_PIXELS:
+                raise serializers.ValidationError(
+                    f"图片像素过多：{width}x{height}，最多允许 {settings.MAX_IMAGE_PIXELS} 像素。"
+                )
+
+        # 提前检查是否超出用户的存储配额；Image.save() 会在事务中加锁再次检查
+        request = self.context.get('request')
+        if request is not None and request.user.is_authenticated:
+            usage = StorageUsage.objects.filter(user=request.user).first()
+            quota = usage.effective_quota if usage else settings.STORAGE_QUOTA_BYTES
+            if quota:
+                used = usage.total_bytes if usage else 0
+                if self.instance is not None:
+                    # 替换图片时原文件的空间会被释放
+                    used -= self.instance.size or 0
+                if used + value.size > quota:
+                    raise serializers.ValidationError(
+                        f"存储空间不足：已使用 {used} bytes，配额 {quota} bytes，本次上传 {value.size} bytes。"
+                    )
+
         # 可选：添加对图片大小或类型的验证
         # 例如：限制文件大小
         # max_size = 5 * 1024 * 1024 # 5MB
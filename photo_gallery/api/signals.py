@@ -0,0 +1,57 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from . import cache as api_cache
+from .models import Image, Group, HomeLayout, StorageUsage
+
+
+def _invalidate(*tags):
+    # 事务提交后再失效，避免其他 worker 在提交前按新版本号缓存旧数据
+    transaction.on_commit(lambda: api_cache.invalidate_tags(*tags))
+
+
+def _invalidate_image(image_id, owner_id):
+    tags = [api_cache.TAG_IMAGES, api_cache.image_tag(image_id)]
+    if owner_id:
+        tags.append(api_cache.user_images_tag(owner_id))
+    _invalidate(*tags)
+
+
+@receiver(post_save, sender=Image)
+@receiver(post_delete, sender=Image)
+def image_changed(sender, instance, **kwargs):
+    _invalidate_image(instance.pk, instance.owner_id)
+
+
+@receiver(post_delete, sender=Image)
+def image_deleted(sender, instance, **kwargs):
+    # 在删除所在的事务中扣减存储用量，覆盖单个删除、批量删除和级联删除
+    StorageUsage.adjust(instance.owner_id, -1, -(instance.size or 0))
+
+
+@receiver(m2m_changed, sender=Image.groups.through)
+def image_groups_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if not reverse:
+        _invalidate(api_cache.image_tag(instance.pk))
+    elif pk_set:
+        # 从分组一侧修改 (group.images.add(...))，pk_set 为图片 ID
+        _invalidate(*(api_cache.image_tag(pk) for pk in pk_set))
+    else:
+        # group.images.clear() 不提供 pk_set，图片详情中的分组信息依赖分组标签
+        _invalidate(api_cache.TAG_GROUPS)
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def group_changed(sender, instance, **kwargs):
+    # 图片详情中包含分组 ID，同样绑定了分组标签
+    _invalidate(api_cache.TAG_GROUPS)
+
+
+@receiver(post_save, sender=HomeLayout)
+@receiver(post_delete, sender=HomeLayout)
+def layout_changed(sender, instance, **kwargs):
+    _invalidate(api_cache.user_layouts_tag(instance.user_id))
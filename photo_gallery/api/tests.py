@@ -1,3 +1,498 @@
-from django.test import TestCase
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from unittest import mock, skipUnless
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache, caches
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connections
+from django.utils import timezone
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from PIL import Image as PILImage
+from rest_framework.test import APIClient
+
+from . import admission, layout_engine, media_gc, placeholders
+from . import cache as api_cache
+from .models import Group, HomeLayout, Image, StorageQuotaExceeded, StorageUsage
+from .serializers import ImageSerializer
+from .throttling import AuthRateThrottle
 
 # Create your tests here.
+
+
+def make_png(name='photo.png', size=(20, 10)):
+    buffer = io.BytesIO()
+    PILImage.new('RGB', size, (200, 10, 10)).save(buffer, 'PNG')
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class CacheInvalidationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('owner', password='password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def get(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_group_list_refreshes_after_new_group(self):
+        self.assertEqual(self.get('/api/groups/'), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            Group.objects.create(name='风景')
+        self.assertEqual([group['name'] for group in self.get('/api/groups/')], ['风景'])
+
+    def test_image_detail_refreshes_after_group_changes(self):
+        image = Image.objects.create(image=make_png(), owner=self.user)
+        group = Group.objects.create(name='风景')
+        url = f'/api/images/{image.pk}/'
+        self.assertEqual(self.get(url)['groups'], [])
+
+        # 分别从图片一侧和分组一侧修改多对多关系
+        changes = [
+            (lambda: image.groups.add(group), [group.pk]),
+            (lambda: image.groups.clear(), []),
+            (lambda: group.images.add(image), [group.pk]),
+            (lambda: group.images.clear(), []),
+        ]
+        for change, expected in changes:
+            with self.captureOnCommitCallbacks(execute=True):
+                change()
+            self.assertEqual(self.get(url)['groups'], expected)
+
+    def test_padded_pk_shares_invalidated_cache_entry(self):
+        image = Image.objects.create(image=make_png(), name='旧名称', owner=self.user)
+        padded_url = f'/api/images/0{image.pk}/'
+        self.assertEqual(self.get(padded_url)['name'], '旧名称')
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(f'/api/images/{image.pk}/', {'name': '新名称'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.get(padded_url)['name'], '新名称')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            image.delete()
+        self.assertEqual(self.client.get(padded_url).status_code, 404)
+        self.assertEqual(self.client.get('/api/images/abc/').status_code, 404)
+
+    def test_counts_refresh_after_delete(self):
+        image = Image.objects.create(image=make_png(), owner=self.user)
+        self.assertEqual(self.get('/api/images/counts/'), {'total': 1, 'mine': 1})
+        with self.captureOnCommitCallbacks(execute=True):
+            image.delete()
+        self.assertEqual(self.get('/api/images/counts/'), {'total': 0, 'mine': 0})
+
+    def test_active_layout_refreshes_after_activation(self):
+        current = HomeLayout.objects.create(user=self.user, name='当前', is_active=True)
+        other = HomeLayout.objects.create(user=self.user, name='其他')
+        self.assertEqual(self.get('/api/layouts/active/')['id'], current.pk)
+        # unique_together (user, is_active) 下只能有一个未激活的布局，先删除当前布局；
+        # 删除注册的 on_commit 回调不会执行，缓存中仍是旧的激活布局，只有激活操作的失效能刷新它
+        current.delete()
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(f'/api/layouts/{other.pk}/activate/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.get('/api/layouts/active/')['id'], other.pk)
+
+
+class GetOrComputeTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_early_expiry_depends_on_remaining_time(self):
+        calls = []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.05)
+            return len(calls)
+
+        self.assertEqual(api_cache.get_or_compute('xfetch', compute, timeout=1), 1)
+
+        # random() 为 0 时不会提前过期；接近 1 时提前量远大于剩余的 1 秒，由当前调用重新计算
+        with mock.patch.object(api_cache.random, 'random', return_value=0.0):
+            self.assertEqual(api_cache.get_or_compute('xfetch', compute, timeout=1), 1)
+        with mock.patch.object(api_cache.random, 'random', return_value=1 - 1e-12):
+            self.assertEqual(api_cache.get_or_compute('xfetch', compute, timeout=1), 2)
+        self.assertEqual(len(calls), 2)
+
+    def test_second_caller_waits_for_lock_holder(self):
+        waiter_results = []
+        waiter_compute = mock.Mock(return_value='waiter')
+        waiter = threading.Thread(
+            target=lambda: waiter_results.append(api_cache.get_or_compute('stampede', waiter_compute))
+        )
+
+        def compute():
+            # 持有回源锁期间，另一个线程请求同一个键
+            waiter.start()
+            time.sleep(api_cache.LOCK_POLL_INTERVAL * 4)
+            return 'holder'
+
+        self.assertEqual(api_cache.get_or_compute('stampede', compute), 'holder')
+        waiter.join()
+        self.assertEqual(waiter_results, ['holder'])
+        waiter_compute.assert_not_called()
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class StorageQuotaTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('owner', password='password')
+
+    def test_save_enforces_quota_under_lock(self):
+        # 绕过序列化器的提前检查，配额仍在 Image.save() 的事务中生效
+        StorageUsage.objects.create(user=self.user, image_count=1, total_bytes=90, quota_bytes=100)
+        with self.assertRaises(StorageQuotaExceeded):
+            Image.objects.create(image=make_png(), owner=self.user)
+        self.assertFalse(Image.objects.exists())
+        self.assertEqual(StorageUsage.objects.get(user=self.user).total_bytes, 90)
+
+    def test_upload_over_quota_returns_400(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        with self.settings(STORAGE_QUOTA_BYTES=10):
+            response = client.post('/api/images/', {'image': make_png()}, format='multipart')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('image', response.data)
+
+    def test_quota_error_from_save_returns_400(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        with self.settings(STORAGE_QUOTA_BYTES=10), \
+                mock.patch.object(ImageSerializer, 'validate_image', side_effect=lambda value: value):
+            response = client.post('/api/images/', {'image': make_png()}, format='multipart')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('image', response.data)
+        self.assertFalse(Image.objects.exists())
+
+
+class ThrottleTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_forwarded_for_does_not_bypass_auth_throttle(self):
+        client = APIClient()
+        rate = int(settings.REST_FRAMEWORK['DEFAULT_THROTTLE_RATES']['auth'].split('/')[0])
+        for index in range(rate):
+            response = client.post('/api/token/refresh/', {'refresh': 'invalid'}, HTTP_X_FORWARDED_FOR=f'10.0.0.{index}')
+            self.assertNotEqual(response.status_code, 429)
+        response = client.post('/api/token/refresh/', {'refresh': 'invalid'}, HTTP_X_FORWARDED_FOR='10.0.1.1')
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response.headers)
+
+    def test_concurrent_requests_do_not_share_tokens(self):
+        request = RequestFactory().post('/api/token/')
+
+        # 缓存后端实例按线程创建，需要替换后端类的方法
+        backend = type(caches['default'])
+        backend_get = backend.get
+
+        def slow_get(self, key, default=None, version=None):
+            # 读取桶状态后让出 CPU，放大读改写之间的竞争窗口
+            value = backend_get(self, key, default, version)
+            time.sleep(0.005)
+            return value
+
+        allowed = []
+        with mock.patch.object(backend, 'get', slow_get):
+            threads = [
+                threading.Thread(target=lambda: allowed.append(AuthRateThrottle().allow_request(request, None)))
+                for _ in range(30)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        rate = int(settings.REST_FRAMEWORK['DEFAULT_THROTTLE_RATES']['auth'].split('/')[0])
+        self.assertLessEqual(allowed.count(True), rate)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), UPLOAD_SLOT_TIMEOUT=0.01)
+class UploadAdmissionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('owner', password='password'))
+
+    def test_request_body_is_parsed_inside_upload_slot(self):
+        # 没有空位时直接返回 503，不会先解析上传的文件
+        with mock.patch.object(admission, '_upload_slots', threading.BoundedSemaphore(1)) as slots, \
+                mock.patch('rest_framework.request.Request._parse') as parse:
+            slots.acquire()
+            response = self.client.post('/api/images/', {'image': make_png()}, format='multipart')
+        self.assertEqual(response.status_code, 503)
+        self.assertIn('Retry-After', response.headers)
+        parse.assert_not_called()
+
+
+class LayoutEngineTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('owner', password='password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_invalid_config_values_fall_back_to_defaults(self):
+        config = layout_engine.normalize_config({'layout_type': 'spiral', 'image_spacing': 'abc', 'grid_padding': -5})
+        self.assertEqual(config['layout_type'], 'grid')
+        self.assertEqual(config['image_spacing'], layout_engine.DEFAULT_SPACING)
+        self.assertEqual(config['grid_padding'], 0)
+        self.assertEqual(layout_engine.normalize_config([1, 2])['columns'], layout_engine.DEFAULT_COLUMNS)
+
+    def test_columns_are_bounded(self):
+        items = [{'id': index, 'width': 4, 'height': 3} for index in range(100)]
+        layout, tiles, _, _ = layout_engine.pack(items, {'layout_type': 'masonry', 'xs': 100000000}, 375)
+        self.assertEqual(layout['columns'], layout_engine.COLUMNS_RANGE[1])
+        self.assertEqual(len(tiles), 100)
+
+    def test_consecutive_pages_match_single_pack(self):
+        sizes = [(4000, 3000), (3000, 4000), (1920, 1080), (1080, 1920), (2048, 2048), (6000, 2000)]
+        items = [{'id': index, 'width': w, 'height': h} for index, (w, h) in enumerate(sizes * 7)]
+        for layout_type in layout_engine.LAYOUT_TYPES:
+            config = {'layout_type': layout_type, 'xs': 3, 'row_height': 120}
+            _, expected, expected_height, _ = layout_engine.pack(items, config, 375)
+
+            _, first, _, state = layout_engine.pack(items[:20], config, 375, final=False)
+            # 续排状态经过 cursor 的 JSON 往返
+            state = layout_engine.normalize_state(
+                json.loads(json.dumps(state)), layout_engine.normalize_config(config), 375
+            )
+            _, second, height, _ = layout_engine.pack(items[len(first):], config, 375, state)
+            self.assertEqual(first + second, expected, layout_type)
+            self.assertEqual(height, expected_height, layout_type)
+
+    def test_tiles_endpoint_pages_continue_layout(self):
+        for index in range(25):
+            Image.objects.create(image=f'photo{index}.png')
+            Image.objects.filter(pk=Image.objects.latest('pk').pk).update(width=1000 + index * 150, height=1000)
+        for layout_type in layout_engine.LAYOUT_TYPES:
+            cache.clear()
+            HomeLayout.objects.update_or_create(
+                user=self.user, is_active=True, defaults={'name': '布局', 'config': {'layout_type': layout_type}}
+            )
+            expected = self.client.get('/api/layouts/tiles/', {'width': 800, 'page_size': 100}).data['tiles']
+
+            tiles, params = [], {'width': 800, 'page_size': 7}
+            while True:
+                response = self.client.get('/api/layouts/tiles/', params)
+                self.assertEqual(response.status_code, 200)
+                tiles += response.data['tiles']
+                if response.data['next_cursor'] is None:
+                    break
+                params['cursor'] = response.data['next_cursor']
+            self.assertEqual(tiles, expected, layout_type)
+
+            # 其他宽度不能沿用该 cursor
+            response = self.client.get('/api/layouts/tiles/', dict(params, width=1600))
+            self.assertEqual(response.status_code, 400)
+
+    def test_viewport_width_is_never_rounded_up(self):
+        for width, expected in ((10, 10), (16, 16), (390, 384)):
+            response = self.client.get('/api/layouts/tiles/', {'width': width})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.data['width'], expected)
+
+    def test_tiles_endpoint_accepts_malformed_config(self):
+        for config in ({'image_spacing': 'abc'}, [1, 2, 3], {'layout_type': 'masonry', 'xs': 100000000}):
+            HomeLayout.objects.update_or_create(user=self.user, is_active=True, defaults={'name': '布局', 'config': config})
+            response = self.client.get('/api/layouts/tiles/', {'width': 375})
+            self.assertEqual(response.status_code, 200)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class PlaceholderTests(TestCase):
+    def test_blurhash_matches_reference_vector(self):
+        # 期望值由参考实现 (blurhash-python 1.1.5) 对同一组像素编码得到
+        pixels = [((x * 40) % 256, (y * 60) % 256, ((x + y) * 25) % 256) for y in range(6) for x in range(8)]
+        self.assertEqual(placeholders.encode_blurhash(pixels, 8, 6), 'LqG98XBxA+^7z@R#SQr?dGetfReo')
+
+    def test_blurhash_dc_component_is_average_color(self):
+        blurhash = placeholders.encode_blurhash([(200, 10, 10)] * 12, 4, 3)
+        self.assertEqual(len(blurhash), 28)
+        # 第 3-6 个字符为 DC 分量，即以 sRGB 表示的平均颜色
+        value = 0
+        for char in blurhash[2:6]:
+            value = value * 83 + placeholders._BASE83.index(char)
+        self.assertEqual((value >> 16, (value >> 8) & 255, value & 255), (200, 10, 10))
+
+    def test_dominant_color_of_solid_image(self):
+        image = PILImage.new('RGB', (32, 32), (30, 120, 200))
+        self.assertEqual(placeholders.dominant_color(image), '#1e78c8')
+
+    def test_upload_stores_placeholders(self):
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user('owner', password='password'))
+        response = client.post('/api/images/', {'image': make_png()}, format='multipart')
+        self.assertEqual(response.status_code, 201)
+
+        response = client.get('/api/images/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data[0]['blurhash']), 28)
+        self.assertEqual(response.data[0]['dominant_color'], '#c80a0a')
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class BackfillPlaceholdersTests(TestCase):
+    def test_checkpoint_does_not_skip_failed_images(self):
+        checkpoint = os.path.join(tempfile.mkdtemp(), 'checkpoint')
+        missing = Image.objects.create(image='missing.png')
+        present = Image.objects.create(image=make_png())
+        Image.objects.update(blurhash='', dominant_color='')
+
+        call_command('backfill_placeholders', workers=1, checkpoint=checkpoint, stdout=io.StringIO(), stderr=io.StringIO())
+        self.assertNotEqual(Image.objects.get(pk=present.pk).blurhash, '')
+        with open(checkpoint) as f:
+            self.assertLess(int(f.read()), missing.pk)
+
+        # 文件恢复后再次运行，从检查点继续时会重试之前失败的图片
+        default_storage.save('missing.png', make_png())
+        call_command('backfill_placeholders', workers=1, checkpoint=checkpoint, stdout=io.StringIO(), stderr=io.StringIO())
+        self.assertNotEqual(Image.objects.get(pk=missing.pk).blurhash, '')
+
+
+class MediaGCTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        override = override_settings(MEDIA_ROOT=media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.media_root = media_root
+        self.user = User.objects.create_user('owner', password='password')
+
+    def write_file(self, name, age_hours=48):
+        path = os.path.join(self.media_root, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(b'data')
+        mtime = time.time() - age_hours * 3600
+        os.utime(path, (mtime, mtime))
+
+    def create_image(self, name, age_hours=48):
+        image = Image.objects.create(image=name)
+        Image.objects.filter(pk=image.pk).update(uploaded_at=timezone.now() - timedelta(hours=age_hours))
+        return image
+
+    def gc(self, *args):
+        out = io.StringIO()
+        call_command('gc_media', *args, stdout=out)
+        return out.getvalue()
+
+    def test_storage_and_database_use_the_same_order(self):
+        # '.' < '/' < '0'：目录 a/ 的子路径排在 a.b 和 a0 之间
+        names = ['a0', 'a/x.png', 'a.b']
+        for name in names:
+            self.write_file(name)
+            self.create_image(name)
+        expected = ['a.b', 'a/x.png', 'a0']
+        self.assertEqual(list(media_gc.iter_storage_names(default_storage)), expected)
+        self.assertEqual(list(media_gc.iter_db_names(batch_size=1)), expected)
+        self.assertEqual(list(media_gc.merge_join(
+            media_gc.iter_storage_names(default_storage), media_gc.iter_db_names(batch_size=1)
+        )), [])
+
+    def test_hidden_files_and_directories_are_skipped(self):
+        for name in ('.hidden.png', '.cache/orphan.png', 'a/.cache/orphan.png', 'a/orphan.png'):
+            self.write_file(name)
+        self.assertEqual(list(media_gc.iter_storage_names(default_storage)), ['a/orphan.png'])
+        self.gc('--delete')
+        self.assertTrue(default_storage.exists('.cache/orphan.png'))
+        self.assertTrue(default_storage.exists('a/.cache/orphan.png'))
+        self.assertFalse(default_storage.exists('a/orphan.png'))
+
+    def test_unsorted_stream_aborts_before_deleting(self):
+        self.write_file('orphan.png')
+        unsorted = media_gc._ensure_sorted(iter(['b.png', 'a.png']), '数据库')
+        with mock.patch('api.management.commands.gc_media.iter_db_names', return_value=unsorted):
+            with self.assertRaises(CommandError):
+                self.gc('--delete')
+        self.assertTrue(default_storage.exists('orphan.png'))
+
+    def test_grace_period_skips_recent_orphans_and_records(self):
+        self.write_file('recent-orphan.png', age_hours=1)
+        recent = self.create_image('recent-missing.png', age_hours=1)
+        self.gc('--delete', '--prune-missing')
+        self.assertTrue(default_storage.exists('recent-orphan.png'))
+        self.assertTrue(Image.objects.filter(pk=recent.pk).exists())
+
+    def test_duplicate_database_names_are_merged(self):
+        self.write_file('shared.png')
+        self.create_image('shared.png')
+        self.create_image('shared.png')
+        self.assertEqual(list(media_gc.iter_db_names(batch_size=1)), ['shared.png'])
+        self.assertIn('孤儿文件 0 个', self.gc('--delete', '--prune-missing'))
+        self.assertEqual(Image.objects.count(), 2)
+
+        # 两条记录指向的文件丢失时一起删除
+        default_storage.delete('shared.png')
+        self.assertIn('已删除 2 条', self.gc('--prune-missing'))
+        self.assertFalse(Image.objects.exists())
+
+    def test_delete_and_prune_missing(self):
+        self.write_file('orphan.png')
+        kept = Image.objects.create(image=make_png(), owner=self.user)
+        lost = Image.objects.create(image=make_png(), owner=self.user)
+        Image.objects.update(uploaded_at=timezone.now() - timedelta(hours=48))
+        os.remove(lost.image.path)
+        usage = StorageUsage.objects.get(user=self.user)
+        self.assertEqual((usage.image_count, usage.total_bytes), (2, kept.size + lost.size))
+
+        # 默认只报告，不删除
+        self.gc()
+        self.assertTrue(default_storage.exists('orphan.png'))
+        self.assertEqual(Image.objects.count(), 2)
+
+        self.gc('--delete', '--prune-missing')
+        self.assertFalse(default_storage.exists('orphan.png'))
+        self.assertTrue(default_storage.exists(kept.image.name))
+        self.assertEqual(list(Image.objects.values_list('pk', flat=True)), [kept.pk])
+        usage.refresh_from_db()
+        self.assertEqual((usage.image_count, usage.total_bytes), (1, kept.size))
+
+
+@skipUnless(settings.DATABASE_REPLICAS, "需要通过 DB_REPLICAS 配置只读副本")
+class ReplicaRoutingTests(TransactionTestCase):
+    """
+    使用多个 SQLite 别名运行，例如：
+    DB_ENGINE=django.db.backends.sqlite3 DB_NAME=db.sqlite3 DB_REPLICAS=replica.sqlite3 python manage.py test api
+    """
+    databases = '__all__'
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('admin', password='password', is_staff=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.replica = connections[settings.DATABASE_REPLICAS[0]]
+
+    def replica_queries(self, url):
+        with CaptureQueriesContext(self.replica) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_safe_reads_use_replica(self):
+        self.assertGreater(self.replica_queries('/api/users/'), 0)
+
+    def test_failed_write_does_not_pin_to_primary(self):
+        response = self.client.post('/api/groups/', {'name': ''})
+        self.assertEqual(response.status_code, 400)
+        self.assertGreater(self.replica_queries('/api/users/'), 0)
+
+    def test_reads_stick_to_primary_after_write(self):
+        response = self.client.post('/api/groups/', {'name': '风景'})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.replica_queries('/api/users/'), 0)
@@ -0,0 +1,82 @@
+"""
+基于令牌桶的限流
+
+速率沿用 DRF 的 DEFAULT_THROTTLE_RATES 格式 (如 '30/min')：桶容量为 30，令牌按 30/60 秒的速度匀速补充，
+允许短时突发而长期平均速率不超过设定值。桶的状态保存在共享缓存中，多个 worker 共用同一个桶，
+读取和写回之间通过 cache.add 实现的短锁串行化，并发请求不会重复消耗同一个令牌。
+
+客户端 IP 由 DRF 的 get_ident() 确定，部署在反向代理之后时需要设置 REST_FRAMEWORK['NUM_PROXIES']，
+否则客户端可以伪造 X-Forwarded-For 绕过按 IP 的限流。
+"""
+import time
+
+from rest_framework.throttling import SimpleRateThrottle
+
+LOCK_TIMEOUT = 1            # 桶锁的最长持有时间 (秒)，防止 worker 异常退出后锁无法释放
+LOCK_ATTEMPTS = 20
+LOCK_RETRY_INTERVAL = 0.01
+
+
+class TokenBucketThrottle(SimpleRateThrottle):
+    cache_format = 'throttle:bucket:%(scope)s:%(ident)s'
+
+    def get_cache_key(self, request, view):
+        # 已登录用户按用户限流，匿名用户按 IP 限流
+        if request.user and request.user.is_authenticated:
+            ident = f'user:{request.user.pk}'
+        else:
+            ident = f'ip:{self.get_ident(request)}'
+        return self.cache_format % {'scope': self.scope, 'ident': ident}
+
+    def allow_request(self, request, view):
+        if self.rate is None:
+            return True
+
+        self.key = self.get_cache_key(request, view)
+        if self.key is None:
+            return True
+
+        lock_key = f'{self.key}:lock'
+        for _ in range(LOCK_ATTEMPTS):
+            if self.cache.add(lock_key, 1, LOCK_TIMEOUT):
+                break
+            time.sleep(LOCK_RETRY_INTERVAL)
+        else:
+            # 同一个桶的竞争过于激烈，按超限处理
+            self.wait_seconds = 1
+            return False
+
+        try:
+            now = self.timer()
+            refill_rate = self.num_requests / self.duration
+            tokens, updated_at = self.cache.get(self.key, (self.num_requests, now))
+            tokens = min(self.num_requests, tokens + (now - updated_at) * refill_rate)
+
+            if tokens < 1:
+                self.wait_seconds = (1 - tokens) / refill_rate
+                return False
+
+            # 桶在 duration 内会完全补满，之后缓存过期等价于满桶
+            self.cache.set(self.key, (tokens - 1, now), self.duration)
+            return True
+        finally:
+            self.cache.delete(lock_key)
+
+    def wait(self):
+        return getattr(self, 'wait_seconds', None)
+
+
+class UploadRateThrottle(TokenBucketThrottle):
+    scope = 'upload'
+
+
+class ListRateThrottle(TokenBucketThrottle):
+    scope = 'list'
+
+
+class AuthRateThrottle(TokenBucketThrottle):
+    scope = 'auth'
+
+    def get_cache_key(self, request, view):
+        # 登录/注册请求尚未认证，始终按 IP 限流
+        return self.cache_format % {'scope': self.scope, 'ident': f'ip:{self.get_ident(request)}'}
@@ -1,9 +1,5 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from rest_framework_simplejwt.views import (
-    TokenObtainPairView,
-    TokenRefreshView,
-)
 from . import views
 from django.db import migrations
 import json
@@ -23,8 +19,8 @@ urlpatterns = [
     # 新增获取当前用户信息端点
     path('me/', views.CurrentUserView.as_view(), name='me'),
     # JWT 认证端点
-    path('token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
-    path('token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
+    path('token/', views.ThrottledTokenObtainPairView.as_view(), name='token_obtain_pair'),
+    path('token/refresh/', views.ThrottledTokenRefreshView.as_view(), name='token_refresh'),
 ]
 
 DEFAULT_LAYOUT = {
@@ -1,9 +1,31 @@
+import base64
+import hashlib
+import json
+
+from django.conf import settings
 from django.contrib.auth.models import User
-from rest_framework import viewsets, permissions, status, generics
+from django.core.files.storage import default_storage
+from django.db.models import Q
+from django.http import Http404
+from django.utils.dateparse import parse_datetime
+from rest_framework import viewsets, permissions, status, generics, serializers
 from rest_framework.response import Response
 from rest_framework.decorators import action
+from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 from .serializers import UserSerializer, ImageSerializer, GroupSerializer, HomeLayoutSerializer
-from .models import Image, Group, HomeLayout
+from .models import Image, Group, HomeLayout, StorageQuotaExceeded
+from . import cache as api_cache
+from . import db_router
+from . import layout_engine
+from .admission import upload_slot
+from .throttling import UploadRateThrottle, ListRateThrottle, AuthRateThrottle
+
+# 用户没有激活布局时创建的默认布局配置
+DEFAULT_LAYOUT_CONFIG = {
+    "layout_type": "grid",
+    "xs": 1, "sm": 2, "md": 3, "lg": 4, "xl": 4, "xxl": 6,
+    "image_spacing": 12, "grid_padding": 20
+}
 
 # 自定义权限类，用于确保用户只能修改/删除自己上传的图片
 class IsOwnerOrReadOnly(permissions.BasePermission):
@@ -14,11 +36,44 @@ class IsOwnerOrReadOnly(permissions.BasePermission):
         # 写权限只允许图片的上传者
         return obj.owner == request.user
 
+# 安全方法 (GET/HEAD/OPTIONS) 的读操作走只读副本，写操作后该用户在一段时间内固定读主库
+class ReplicaReadMixin:
+    def dispatch(self, request, *args, **kwargs):
+        self._replica_token = None
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        finally:
+            if self._replica_token is not None:
+                db_router.reset_replica_reads(self._replica_token)
+
+    def initial(self, request, *args, **kwargs):
+        # 认证完成后才能确定用户，认证本身的查询走主库
+        super().initial(request, *args, **kwargs)
+        if request.method in permissions.SAFE_METHODS:
+            user = request.user
+            if not user.is_authenticated or not db_router.is_pinned_to_primary(user.pk):
+                self._replica_token = db_router.enable_replica_reads()
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        # 写操作成功 (已提交) 后才开始计算固定读主库的时长，失败的写操作不固定
+        if (request.method not in permissions.SAFE_METHODS and status.is_success(response.status_code)
+                and request.user.is_authenticated):
+            db_router.pin_to_primary(request.user.pk)
+        return super().finalize_response(request, response, *args, **kwargs)
+
 # 用户注册视图
 class RegisterView(generics.CreateAPIView):
     queryset = User.objects.all()
     serializer_class = UserSerializer
     permission_classes = [permissions.AllowAny]
+    throttle_classes = [AuthRateThrottle]
+
+# 带限流的 JWT 认证视图
+class ThrottledTokenObtainPairView(TokenObtainPairView):
+    throttle_classes = [AuthRateThrottle]
+
+class ThrottledTokenRefreshView(TokenRefreshView):
+    throttle_classes = [AuthRateThrottle]
 
 # 当前用户视图
 class CurrentUserView(generics.RetrieveAPIView):
@@ -28,16 +83,16 @@ class CurrentUserView(generics.RetrieveAPIView):
     def get_object(self):
         return self.request.user
 
-class UserViewSet(viewsets.ReadOnlyModelViewSet):
+class UserViewSet(ReplicaReadMixin, viewsets.ReadOnlyModelViewSet):
     """
     API endpoint that allows users to be viewed.
     """
-    queryset = User.objects.all().order_by('-date_joined')
+    queryset = User.objects.select_related('storage_usage').order_by('-date_joined')
     serializer_class = UserSerializer
     lookup_field = 'username'
     permission_classes = [permissions.IsAdminUser]
 
-class GroupViewSet(viewsets.ModelViewSet):
+class GroupViewSet(ReplicaReadMixin, viewsets.ModelViewSet):
     """
     API endpoint that allows groups to be viewed or edited.
     """
@@ -45,7 +100,21 @@ class GroupViewSet(viewsets.ModelViewSet):
     serializer_class = GroupSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
 
-class ImageViewSet(viewsets.ModelViewSet):
+    def get_throttles(self):
+        if self.action == 'list':
+            return [ListRateThrottle()]
+        return super().get_throttles()
+
+    def list(self, request, *args, **kwargs):
+        # 分组列表读多写少，缓存序列化结果，分组变更时由信号失效
+        data = api_cache.get_or_compute(
+            'groups:list',
+            lambda: self.get_serializer(self.filter_queryset(self.get_queryset()), many=True).data,
+            tags=[api_cache.TAG_GROUPS],
+        )
+        return Response(data)
+
+class ImageViewSet(ReplicaReadMixin, viewsets.ModelViewSet):
     """
     API endpoint that allows images to be viewed, created, updated, and deleted.
     """
@@ -63,20 +132,76 @@ class ImageViewSet(viewsets.ModelViewSet):
         
         return queryset
 
+    def get_throttles(self):
+        if self.action == 'create':
+            return [UploadRateThrottle()]
+        if self.action == 'list':
+            return [ListRateThrottle()]
+        return super().get_throttles()
+
+    def retrieve(self, request, *args, **kwargs):
+        # ?mine=true 会改变可见范围，此时不走缓存
+        if 'mine' in request.query_params:
+            return super().retrieve(request, *args, **kwargs)
+        # 信号按整数主键失效缓存，/api/images/01/ 这类 URL 需要先规范化，否则会命中无法失效的缓存键
+        try:
+            pk = int(kwargs[self.lookup_field])
+        except ValueError:
+            raise Http404
+        # 序列化结果中的图片 URL 依赖请求的协议和主机
+        key = f'image:{pk}:{request.scheme}://{request.get_host()}'
+        data = api_cache.get_or_compute(
+            key,
+            lambda: self.get_serializer(self.get_object()).data,
+            tags=[api_cache.image_tag(pk), api_cache.TAG_GROUPS],
+        )
+        return Response(data)
+
+    @action(detail=False, methods=['get'])
+    def counts(self, request):
+        """获取图片总数以及当前用户的图片数"""
+        data = {
+            'total': api_cache.get_or_compute(
+                'images:count',
+                lambda: Image.objects.count(),
+                tags=[api_cache.TAG_IMAGES],
+            ),
+            'mine': None,
+        }
+        if request.user.is_authenticated:
+            user_id = request.user.pk
+            data['mine'] = api_cache.get_or_compute(
+                f'user:{user_id}:images:count',
+                lambda: Image.objects.filter(owner_id=user_id).count(),
+                tags=[api_cache.user_images_tag(user_id)],
+            )
+        return Response(data)
+
     def create(self, request, *args, **kwargs):
-        print("--- Debugging Image Upload ---")
-        print(f"Request Method: {request.method}")
-        print(f"Request Headers: {request.headers}")
-        print(f"Request Content-Type: {request.content_type}")
-        print(f"Request Data (request.data): {request.data}")
-        print(f"Request Files (request.FILES): {request.FILES}")
-        print("--- End Debugging ---")
-        
-        return super().create(request, *args, **kwargs)
+        # 限制每个 worker 同时解析/保存的上传数量，请求体的解析也在名额内进行
+        with upload_slot():
+            return super().create(request, *args, **kwargs)
+
+    def update(self, request, *args, **kwargs):
+        # 可能替换图片文件的 multipart 请求同样需要占用上传名额；
+        # 只根据 Content-Type 判断，避免在获得名额前解析请求体
+        if request.content_type.startswith('multipart/'):
+            with upload_slot():
+                return super().update(request, *args, **kwargs)
+        return super().update(request, *args, **kwargs)
 
     def perform_create(self, serializer):
         # 自动设置上传图片的用户为当前登录用户
-        serializer.save(owner=self.request.user)
+        try:
+            serializer.save(owner=self.request.user)
+        except StorageQuotaExceeded as e:
+            raise serializers.ValidationError({'image': e.messages})
+
+    def perform_update(self, serializer):
+        try:
+            serializer.save()
+        except StorageQuotaExceeded as e:
+            raise serializers.ValidationError({'image': e.messages})
 
 class HomeLayoutViewSet(viewsets.ModelViewSet):
     """
@@ -100,14 +225,28 @@ class HomeLayoutViewSet(viewsets.ModelViewSet):
         # 创建时自动关联当前用户
         serializer.save(user=self.request.user)
 
+    def get_throttles(self):
+        if self.action == 'tiles':
+            return [ListRateThrottle()]
+        return super().get_throttles()
+
+    def _active_layout_data(self, user):
+        layout = HomeLayout.objects.filter(user=user, is_active=True).first()
+        if layout is None:
+            return None
+        return self.get_serializer(layout).data
+
     @action(detail=False, methods=['get'])
     def active(self, request):
         """获取用户当前激活的布局"""
-        try:
-            layout = HomeLayout.objects.get(user=request.user, is_active=True)
-            serializer = self.get_serializer(layout)
-            return Response(serializer.data)
-        except HomeLayout.DoesNotExist:
+        data = api_cache.get_or_compute(
+            f'layout:active:{request.user.pk}',
+            lambda: self._active_layout_data(request.user),
+            tags=[api_cache.user_layouts_tag(request.user.pk)],
+        )
+        if data is not None:
+            return Response(data)
+        else:
             # 如果没有激活的布局，尝试创建一个默认布局
             try:
                 # 创建默认布局
@@ -115,11 +254,7 @@ class HomeLayoutViewSet(viewsets.ModelViewSet):
                     user=request.user,
                     name="默认网格布局",
                     is_active=True,
-                    config={
-                        "layout_type": "grid",
-                        "xs": 1, "sm": 2, "md": 3, "lg": 4, "xl": 4, "xxl": 6,
-                        "image_spacing": 12, "grid_padding": 20
-                    }
+                    config=dict(DEFAULT_LAYOUT_CONFIG)
                 )
                 serializer = self.get_serializer(default_layout)
                 return Response(serializer.data)
@@ -130,6 +265,98 @@ class HomeLayoutViewSet(viewsets.ModelViewSet):
                     status=status.HTTP_404_NOT_FOUND
                 )
     
+    @staticmethod
+    def _encode_cursor(row, state):
+        # cursor 同时记录键集分页的位置和上一页结束时的排版状态
+        raw = json.dumps([row['uploaded_at'].isoformat(), row['id'], state])
+        return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+    @staticmethod
+    def _decode_cursor(cursor):
+        try:
+            uploaded_at, image_id, state = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+            uploaded_at = parse_datetime(uploaded_at)
+        except (ValueError, TypeError, UnicodeError):
+            return None
+        if uploaded_at is None or not isinstance(image_id, int):
+            return None
+        return (uploaded_at, image_id), state
+
+    def _tiles_page(self, config, viewport_width, page_size, position, state):
+        # 按上传时间倒序的键集分页，翻页代价与页码无关
+        queryset = Image.objects.order_by('-uploaded_at', '-id')
+        if position is not None:
+            uploaded_at, image_id = position
+            queryset = queryset.filter(Q(uploaded_at__lt=uploaded_at) | Q(uploaded_at=uploaded_at, id__lt=image_id))
+        rows = list(queryset.values(
+            'id', 'image', 'width', 'height', 'blurhash', 'dominant_color', 'uploaded_at'
+        )[:page_size + 1])
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+        for row in rows:
+            # 使用不含主机名的 URL，排版结果可以在不同主机间共享缓存
+            row['image'] = default_storage.url(row['image']) if row['image'] else None
+
+        layout, tiles, height, next_state = layout_engine.pack(rows, config, viewport_width, state, final=not has_more)
+        if has_more and not tiles:
+            # page_size 太小，一页内凑不满一整行时直接排出该页
+            layout, tiles, height, next_state = layout_engine.pack(rows, config, viewport_width, state)
+        # justified 布局末尾不足一行的图片留给下一页，下一页从最后一张已排版的图片之后开始
+        next_cursor = self._encode_cursor(rows[len(tiles) - 1], next_state) if has_more else None
+        return {**layout, 'width': viewport_width, 'height': height, 'tiles': tiles, 'next_cursor': next_cursor}
+
+    @action(detail=False, methods=['get'])
+    def tiles(self, request):
+        """按当前激活布局和视口宽度返回一页图片的排版结果"""
+        try:
+            viewport_width = int(request.query_params.get('width', ''))
+            page_size = int(request.query_params.get('page_size', settings.LAYOUT_PAGE_SIZE))
+        except ValueError:
+            return Response({"detail": "width 和 page_size 必须为整数。"}, status=status.HTTP_400_BAD_REQUEST)
+        if not 1 <= viewport_width <= settings.LAYOUT_MAX_VIEWPORT_WIDTH:
+            return Response(
+                {"detail": f"width 必须在 1 到 {settings.LAYOUT_MAX_VIEWPORT_WIDTH} 之间。"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        page_size = min(max(page_size, 1), settings.LAYOUT_MAX_PAGE_SIZE)
+
+        cursor = request.query_params.get('cursor') or ''
+        position = state = None
+        if cursor:
+            decoded = self._decode_cursor(cursor)
+            if decoded is None:
+                return Response({"detail": "无效的 cursor。"}, status=status.HTTP_400_BAD_REQUEST)
+            position, state = decoded
+
+        layout_data = api_cache.get_or_compute(
+            f'layout:active:{request.user.pk}',
+            lambda: self._active_layout_data(request.user),
+            tags=[api_cache.user_layouts_tag(request.user.pk)],
+        )
+        # 配置是用户保存的任意 JSON，整理后再排版，整理结果也用于缓存键
+        config = layout_engine.normalize_config(layout_data['config'] if layout_data else DEFAULT_LAYOUT_CONFIG)
+
+        # 视口宽度向下取整到分桶，相近宽度的客户端共享同一份排版结果，按实际宽度等比缩放即可；
+        # 不足一个分桶的宽度保持原值，排版结果不会比视口更宽
+        bucket = settings.LAYOUT_VIEWPORT_BUCKET
+        viewport_width = viewport_width // bucket * bucket or viewport_width
+
+        if cursor:
+            # 续排状态必须来自相同布局和宽度的上一页
+            state = layout_engine.normalize_state(state, config, viewport_width)
+            if state is None:
+                return Response({"detail": "cursor 与当前布局或宽度不匹配。"}, status=status.HTTP_400_BAD_REQUEST)
+
+        # cursor 中包含排版状态，长度随列数增长，取哈希后再放入缓存键
+        cursor_hash = hashlib.sha1(cursor.encode('utf-8')).hexdigest()
+        key = f'layout:tiles:{layout_engine.config_hash(config)}:{viewport_width}:{page_size}:{cursor_hash}'
+        data = api_cache.get_or_compute(
+            key,
+            lambda: self._tiles_page(config, viewport_width, page_size, position, state),
+            tags=[api_cache.TAG_IMAGES],
+        )
+        return Response(data)
+
     @action(detail=True, methods=['post'])
     def activate(self, request, pk=None):
         """将指定布局设为活跃布局"""
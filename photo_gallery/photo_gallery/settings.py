@@ -89,17 +89,77 @@ WSGI_APPLICATION = 'photo_gallery.wsgi.application'
 #     }
 # }
 
+# 数据库连接均可通过环境变量配置，默认值与本地开发环境一致
 DATABASES = {
     "default": {
-        "ENGINE": "django.db.backends.mysql",
-        "NAME": "photo_gallery",
-        "USER": "admin",
-        "PASSWORD": "iodaa",
-        "HOST": "127.0.0.1",
-        "PORT": "13306",
+        "ENGINE": os.environ.get("DB_ENGINE", "django.db.backends.mysql"),
+        "NAME": os.environ.get("DB_NAME", "photo_gallery"),
+        "USER": os.environ.get("DB_USER", "admin"),
+        "PASSWORD": os.environ.get("DB_PASSWORD", "iodaa"),
+        "HOST": os.environ.get("DB_HOST", "127.0.0.1"),
+        "PORT": os.environ.get("DB_PORT", "13306"),
+        # 持久连接：连接在 worker 内复用，避免每个请求都重新建立 TCP 连接和认证
+        "CONN_MAX_AGE": int(os.environ.get("DB_CONN_MAX_AGE", 60)),
+        # 复用连接前检查连接是否可用，失效时自动重连
+        "CONN_HEALTH_CHECKS": os.environ.get("DB_CONN_HEALTH_CHECKS", "true").lower() == "true",
     }
 }
 
+# 只读副本：DB_REPLICAS 为逗号分隔的列表，MySQL 时每项为 host[:port]，SQLite 时每项为数据库文件路径。
+# 副本的其他连接参数与主库相同，测试时作为主库的镜像。
+DATABASE_REPLICAS = []
+for _index, _replica in enumerate(filter(None, os.environ.get("DB_REPLICAS", "").split(","))):
+    _alias = f"replica_{_index + 1}"
+    _config = dict(DATABASES["default"], TEST={"MIRROR": "default"})
+    if _config["ENGINE"] == "django.db.backends.sqlite3":
+        _config["NAME"] = _replica.strip()
+    else:
+        _host, _, _port = _replica.strip().partition(":")
+        _config["HOST"] = _host
+        _config["PORT"] = _port or _config["PORT"]
+    DATABASES[_alias] = _config
+    DATABASE_REPLICAS.append(_alias)
+
+DATABASE_ROUTERS = ['api.db_router.PrimaryReplicaRouter']
+
+# 用户写入后读操作固定走主库的时长 (秒)，应大于副本的复制延迟
+DATABASE_REPLICA_STICKY_SECONDS = int(os.environ.get("DB_REPLICA_STICKY_SECONDS", 5))
+
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+
+# 设置 REDIS_URL (如 redis://127.0.0.1:6379/0) 时使用 Redis 或兼容协议的服务作为多 worker 共享缓存；
+# 未设置时使用本地内存缓存 (开发/测试)
+REDIS_URL = os.environ.get('REDIS_URL')
+
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+            'KEY_PREFIX': 'photo_gallery',
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'photo_gallery',
+        }
+    }
+
+# API 查询结果的缓存时间 (秒)，数据变更时会通过信号提前失效
+API_CACHE_TIMEOUT = int(os.environ.get('API_CACHE_TIMEOUT', 300))
+
+# 每个用户的默认存储配额 (bytes)，0 表示不限制；可在 StorageUsage.quota_bytes 中为单个用户单独设置
+STORAGE_QUOTA_BYTES = int(os.environ.get('STORAGE_QUOTA_BYTES', 0)) or None
+
+# 服务端排版 (/api/layouts/tiles/)：视口宽度分桶大小 (px，16 的倍数与所有断点对齐)、默认/最大每页图片数和最大视口宽度
+LAYOUT_VIEWPORT_BUCKET = int(os.environ.get('LAYOUT_VIEWPORT_BUCKET', 16))
+LAYOUT_PAGE_SIZE = 50
+LAYOUT_MAX_PAGE_SIZE = 200
+LAYOUT_MAX_VIEWPORT_WIDTH = 7680
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -147,8 +207,25 @@ REST_FRAMEWORK = {
         'rest_framework_simplejwt.authentication.JWTAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ),
+    # 应用前的可信反向代理数量，用于从 X-Forwarded-For 中取出真实客户端 IP；
+    # 为 0 时直接使用 REMOTE_ADDR，忽略客户端可伪造的 X-Forwarded-For
+    'NUM_PROXIES': int(os.environ.get('NUM_PROXIES', 0)),
+    # 令牌桶限流速率 (见 api/throttling.py)，桶容量为周期内的请求数
+    'DEFAULT_THROTTLE_RATES': {
+        'upload': os.environ.get('THROTTLE_UPLOAD_RATE', '30/min'),
+        'auth': os.environ.get('THROTTLE_AUTH_RATE', '10/min'),
+        'list': os.environ.get('THROTTLE_LIST_RATE', '120/min'),
+    },
 }
 
+# 上传准入控制 (见 api/admission.py)：每个 worker 同时处理的上传数、等待空位的秒数以及 503 响应的 Retry-After 秒数
+MAX_CONCURRENT_UPLOADS = int(os.environ.get('MAX_CONCURRENT_UPLOADS', 4))
+UPLOAD_SLOT_TIMEOUT = float(os.environ.get('UPLOAD_SLOT_TIMEOUT', 2))
+UPLOAD_RETRY_AFTER = int(os.environ.get('UPLOAD_RETRY_AFTER', 5))
+
+# 单张图片允许的最大像素数，超出时拒绝上传以防御解压炸弹
+MAX_IMAGE_PIXELS = int(os.environ.get('MAX_IMAGE_PIXELS', 40_000_000))
+
 # JWT 设置
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(days=1),